@@ -0,0 +1,682 @@
+#!/usr/bin/python
+# coding=utf8
+
+"""
+local benchmark for the FTP, FTPS and SFTP uploaders of the easydb5 plugin.
+
+stand-in servers are started on loopback, synthetic export trees are uploaded with
+upload_files_from_export of easydb-export-transport-ftp.py. every upload runs in its own
+process, so the peak RSS is the one of the uploader only.
+
+usage:
+    python3 ftp_benchmark.py [--protocols ftp,ftps,sftp] [--scenarios tiny,deep,large]
+                             [--connections N] [--scale F] [--json results.json]
+                             [--baseline previous.json]
+
+FTPS needs the openssl command to create a self signed certificate, SFTP needs paramiko.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import resource
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PLUGIN_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'easydb-export-transport-ftp.py'
+)
+
+LOGIN = 'bench'
+PASSWORD = 'bench'
+
+# name -> (number of files, file size, directory depth, files per directory)
+SCENARIOS = {
+    'tiny': (2000, 1024, 1, 200),
+    'deep': (500, 16 * 1024, 8, 4),
+    'large': (3, 64 * 1024 * 1024, 1, 3),
+}
+
+
+class RoundTrips(object):
+    """
+    counts the requests the stand-in servers answered
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self):
+        with self.lock:
+            self.count += 1
+
+    def reset(self):
+        with self.lock:
+            count = self.count
+            self.count = 0
+        return count
+
+
+#
+# FTP / FTPS stand-in server
+#
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """
+    the subset of RFC 959 which ftplib and the plugin use, passive mode only
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+        self.cwd = '/'
+        self.rest = 0
+        self.pasv = None
+        # PROT P: the data connections are encrypted as well
+        self.prot_private = False
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def local_path(self, path):
+        path = os.path.normpath(os.path.join(self.cwd, path))
+        return path, os.path.join(self.server.root, path.lstrip('/'))
+
+    def handle(self):
+        self.reply('220 benchmark ftp server')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            self.server.round_trips.add()
+
+            cmd, _, arg = line.decode('utf-8').rstrip('\r\n').partition(' ')
+            cmd = cmd.upper()
+            if cmd == 'QUIT':
+                self.reply('221 bye')
+                return
+
+            method = getattr(self, 'ftp_' + cmd.lower(), None)
+            if method is None:
+                self.reply('502 %s not implemented' % cmd)
+                continue
+            method(arg)
+
+    def ftp_auth(self, arg):
+        if self.server.ssl_context is None:
+            self.reply('502 no TLS')
+            return
+        self.reply('234 start TLS')
+        self.request = self.server.ssl_context.wrap_socket(self.request, server_side=True)
+        self.rfile = self.request.makefile('rb')
+        self.wfile = self.request.makefile('wb')
+
+    def ftp_pbsz(self, arg):
+        self.reply('200 PBSZ=0')
+
+    def ftp_prot(self, arg):
+        if self.server.ssl_context is None:
+            self.reply('503 no TLS')
+            return
+        self.prot_private = arg.upper() == 'P'
+        self.reply('200 protection level set')
+
+    def ftp_user(self, arg):
+        self.reply('331 password required')
+
+    def ftp_pass(self, arg):
+        self.reply('230 logged in')
+
+    def ftp_syst(self, arg):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_noop(self, arg):
+        self.reply('200 ok')
+
+    def ftp_type(self, arg):
+        self.reply('200 type set')
+
+    def ftp_pwd(self, arg):
+        self.reply('257 "%s"' % self.cwd)
+
+    def ftp_cwd(self, arg):
+        path, local = self.local_path(arg)
+        if not os.path.isdir(local):
+            self.reply('550 %s: No such directory' % path)
+            return
+        self.cwd = path
+        self.reply('250 ok')
+
+    def ftp_mkd(self, arg):
+        path, local = self.local_path(arg)
+        try:
+            os.mkdir(local)
+        except FileExistsError:
+            self.reply('550 %s: File exists' % path)
+            return
+        except OSError as e:
+            self.reply('550 %s: %s' % (path, e.strerror))
+            return
+        self.reply('257 "%s" created' % path)
+
+    def ftp_size(self, arg):
+        path, local = self.local_path(arg)
+        if not os.path.isfile(local):
+            self.reply('550 %s: No such file' % path)
+            return
+        self.reply('213 %d' % os.path.getsize(local))
+
+    def ftp_feat(self, arg):
+        self.reply('211-Features:\r\n MLST type*;size*;\r\n HASH SHA-256*\r\n211 End')
+
+    def ftp_mlsd(self, arg):
+        path, local = self.local_path(arg)
+        if not os.path.isdir(local):
+            self.reply('550 %s: No such directory' % path)
+            return
+        lines = []
+        for entry in os.scandir(local):
+            if entry.is_dir():
+                lines.append('type=dir; %s' % entry.name)
+            else:
+                lines.append('type=file;size=%d; %s' % (entry.stat().st_size, entry.name))
+        self.send(''.join(line + '\r\n' for line in lines).encode('utf-8'))
+
+    def ftp_hash(self, arg):
+        path, local = self.local_path(arg)
+        if not os.path.isfile(local):
+            self.reply('550 %s: No such file' % path)
+            return
+        h = hashlib.sha256()
+        with open(local, 'rb') as f:
+            for data in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(data)
+        size = os.path.getsize(local)
+        self.reply('213 SHA-256 0-%d %s %s' % (size, h.hexdigest(), path))
+
+    def ftp_rest(self, arg):
+        self.rest = int(arg)
+        self.reply('350 restarting at %d' % self.rest)
+
+    def ftp_pasv(self, arg):
+        if self.pasv:
+            self.pasv.close()
+        self.pasv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.pasv.bind(('127.0.0.1', 0))
+        self.pasv.listen(1)
+        port = self.pasv.getsockname()[1]
+        self.reply('227 entering passive mode (127,0,0,1,%d,%d)' % (port >> 8, port & 0xFF))
+
+    def ftp_stor(self, arg):
+        self.receive(arg, 'r+b' if self.rest > 0 else 'wb')
+
+    def ftp_appe(self, arg):
+        self.receive(arg, 'ab')
+
+    def send(self, data):
+        if self.pasv is None:
+            self.reply('425 use PASV first')
+            return
+        self.reply('150 opening data connection')
+        conn = self.accept_data()
+        with conn:
+            conn.sendall(data)
+            if isinstance(conn, ssl.SSLSocket):
+                conn.unwrap()
+        self.reply('226 transfer complete')
+
+    def accept_data(self):
+        conn, _ = self.pasv.accept()
+        self.pasv.close()
+        self.pasv = None
+        if self.prot_private:
+            conn = self.server.ssl_context.wrap_socket(conn, server_side=True)
+        return conn
+
+    def receive(self, arg, mode):
+        path, local = self.local_path(arg)
+        if not os.path.isdir(os.path.dirname(local)):
+            self.reply('553 %s: No such directory' % path)
+            return
+        if self.pasv is None:
+            self.reply('425 use PASV first')
+            return
+
+        rest, self.rest = self.rest, 0
+        if mode == 'r+b' and not os.path.exists(local):
+            mode = 'wb'
+
+        self.reply('150 opening data connection')
+        conn = self.accept_data()
+        with conn, open(local, mode) as f:
+            if rest > 0:
+                f.seek(rest)
+                f.truncate()
+            while True:
+                data = conn.recv(1024 * 1024)
+                if not data:
+                    break
+                f.write(data)
+            if isinstance(conn, ssl.SSLSocket):
+                # answer the close_notify of the client
+                conn.unwrap()
+        self.reply('226 transfer complete')
+
+
+class FTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, round_trips, ssl_context=None):
+        super().__init__(('127.0.0.1', 0), FTPHandler)
+        self.root = root
+        self.round_trips = round_trips
+        self.ssl_context = ssl_context
+
+
+def create_ssl_context(workdir):
+    """
+    TLS context with a self signed certificate, None if openssl is not available
+    """
+    if shutil.which('openssl') is None:
+        return None
+
+    cert = os.path.join(workdir, 'cert.pem')
+    key = os.path.join(workdir, 'key.pem')
+    result = subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+            '-subj', '/CN=localhost', '-days', '1',
+            '-keyout', key, '-out', cert,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    if result.returncode != 0:
+        return None
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+#
+# SFTP stand-in server
+#
+
+
+def start_sftp_server(root, round_trips):
+    """
+    paramiko based SFTP server on loopback, returns the listening socket and the port
+    """
+    import paramiko
+
+    host_key = paramiko.RSAKey.generate(2048)
+
+    class Server(paramiko.ServerInterface):
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    class Handle(paramiko.SFTPHandle):
+
+        def write(self, offset, data):
+            round_trips.add()
+            return super().write(offset, data)
+
+        def stat(self):
+            round_trips.add()
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.fstat(self.writefile.fileno()))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+    class Interface(paramiko.SFTPServerInterface):
+
+        def local_path(self, path):
+            return os.path.join(root, os.path.normpath('/' + path).lstrip('/'))
+
+        def canonicalize(self, path):
+            round_trips.add()
+            return os.path.normpath('/' + path)
+
+        def stat(self, path):
+            round_trips.add()
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def list_folder(self, path):
+            round_trips.add()
+            local = self.local_path(path)
+            try:
+                return [
+                    paramiko.SFTPAttributes.from_stat(
+                        os.stat(os.path.join(local, name)), name
+                    )
+                    for name in os.listdir(local)
+                ]
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def mkdir(self, path, attr):
+            round_trips.add()
+            try:
+                os.mkdir(self.local_path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def remove(self, path):
+            round_trips.add()
+            try:
+                os.remove(self.local_path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def open(self, path, flags, attr):
+            round_trips.add()
+            try:
+                fd = os.open(self.local_path(path), flags, 0o644)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+            if flags & os.O_WRONLY:
+                mode = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                mode = 'rb'
+
+            handle = Handle(flags)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, Interface)
+            transport.start_server(server=Server())
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener, listener.getsockname()[1]
+
+
+#
+# synthetic export trees
+#
+
+
+def make_export_tree(files_dir, count, size, depth, per_dir):
+    """
+    write count files of the given size, per_dir files in each directory which is
+    depth levels deep. returns the file list in the format of the exporter
+    """
+    block = os.urandom(min(size, 1024 * 1024))
+    filelist = []
+    for i in range(count):
+        parts = ['d%d_%d' % (level, (i // per_dir) % (level + 2)) for level in range(depth - 1)]
+        parts.append('dir%d' % (i // per_dir))
+        path = '/'.join(parts + ['file%05d.bin' % i])
+
+        local_file = os.path.join(files_dir, path)
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        with open(local_file, 'wb') as f:
+            written = 0
+            while written < size:
+                written += f.write(block[: size - written])
+
+        filelist.append({'path': path, 'eas_id': i + 1})
+    return filelist
+
+
+#
+# uploader (runs in its own process)
+#
+
+
+class BenchContext(object):
+
+    def get_logger(self, name):
+        return logging.getLogger(name)
+
+
+class BenchExporter(object):
+
+    def __init__(self):
+        self.events = 0
+
+    def logEvent(self, event):
+        self.events += 1
+
+    def isScheduled(self):
+        return False
+
+
+class BenchProtocol(object):
+
+    def __init__(self):
+        self.notices = 0
+        self.warnings = []
+
+    def add_notice(self, notice):
+        self.notices += 1
+
+    def add_warning(self, warning):
+        self.warnings.append(warning)
+
+
+def run_upload(protocol, port, files_dir, filelist_file, connections):
+    spec = importlib.util.spec_from_file_location('transport_ftp', PLUGIN_FILE)
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+
+    with open(filelist_file) as f:
+        filelist = json.load(f)
+
+    opts = {
+        'server': '%s://127.0.0.1:%d' % (protocol, port),
+        'login': LOGIN,
+        'password': PASSWORD,
+        'directory': 'export',
+        'connections': connections,
+    }
+    bench_protocol = BenchProtocol()
+    if protocol == 'sftp':
+        uploader = plugin.SFTP(BenchContext(), opts, bench_protocol)
+    else:
+        uploader = plugin.FTP(BenchContext(), opts, protocol == 'ftps', bench_protocol)
+
+    start = time.monotonic()
+    uploader.upload_files_from_export(BenchExporter(), files_dir, filelist)
+    seconds = time.monotonic() - start
+
+    return {
+        'seconds': seconds,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'warnings': bench_protocol.warnings,
+    }
+
+
+#
+# driver
+#
+
+
+def format_change(value, baseline):
+    if not baseline:
+        return ''
+    return ' (%+.0f%%)' % ((value - baseline) * 100.0 / baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--protocols', default='ftp,ftps,sftp')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--connections', type=int, default=1)
+    parser.add_argument('--scale', type=float, default=1.0, help='scale the number of files')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with the results of a previous run')
+    parser.add_argument('--upload', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.upload:
+        logging.basicConfig(level=logging.ERROR)
+        protocol, port, files_dir, filelist_file = args.upload
+        result = run_upload(protocol, int(port), files_dir, filelist_file, args.connections)
+        json.dump(result, sys.stdout)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r['protocol'], r['scenario']): r for r in json.load(f)}
+
+    workdir = tempfile.mkdtemp(prefix='ftp-benchmark-')
+    results = []
+    try:
+        round_trips = RoundTrips()
+        remote_root = os.path.join(workdir, 'remote')
+
+        print(
+            '%-5s %-6s %7s %9s %8s %10s %8s %11s %9s'
+            % ('proto', 'scen.', 'files', 'MB', 'seconds', 'files/s', 'MB/s', 'round trips', 'RSS MB')
+        )
+
+        for protocol in args.protocols.split(','):
+            if protocol == 'sftp':
+                try:
+                    server, port = start_sftp_server(remote_root, round_trips)
+                except ImportError:
+                    print('%-5s skipped: paramiko is not installed' % protocol)
+                    continue
+            else:
+                ssl_context = None
+                if protocol == 'ftps':
+                    ssl_context = create_ssl_context(workdir)
+                    if ssl_context is None:
+                        print('%-5s skipped: could not create a certificate with openssl' % protocol)
+                        continue
+                server = FTPServer(remote_root, round_trips, ssl_context)
+                port = server.server_address[1]
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            try:
+                for scenario in args.scenarios.split(','):
+                    count, size, depth, per_dir = SCENARIOS[scenario]
+                    count = max(1, int(count * args.scale))
+
+                    files_dir = os.path.join(workdir, 'export-' + scenario)
+                    filelist_file = files_dir + '.json'
+                    if not os.path.exists(filelist_file):
+                        filelist = make_export_tree(files_dir, count, size, depth, per_dir)
+                        with open(filelist_file, 'w') as f:
+                            json.dump(filelist, f)
+
+                    shutil.rmtree(remote_root, ignore_errors=True)
+                    os.makedirs(remote_root)
+                    round_trips.reset()
+
+                    output = subprocess.run(
+                        [
+                            sys.executable, os.path.abspath(__file__),
+                            '--connections', str(args.connections),
+                            '--upload', protocol, str(port), files_dir, filelist_file,
+                        ],
+                        stdout=subprocess.PIPE,
+                        check=True,
+                    ).stdout
+                    upload = json.loads(output)
+
+                    result = {
+                        'protocol': protocol,
+                        'scenario': scenario,
+                        'connections': args.connections,
+                        'files': count,
+                        'bytes': count * size,
+                        'seconds': upload['seconds'],
+                        'files_per_second': count / upload['seconds'],
+                        'mb_per_second': count * size / 1024.0 / 1024.0 / upload['seconds'],
+                        'round_trips': round_trips.reset(),
+                        'max_rss_kb': upload['max_rss_kb'],
+                        'warnings': upload['warnings'],
+                    }
+                    results.append(result)
+
+                    before = baseline.get((protocol, scenario), {})
+                    print(
+                        '%-5s %-6s %7d %9.1f %8.2f %10s %8s %11s %9s'
+                        % (
+                            protocol,
+                            scenario,
+                            count,
+                            result['bytes'] / 1024.0 / 1024.0,
+                            result['seconds'],
+                            '%.0f%s' % (
+                                result['files_per_second'],
+                                format_change(result['files_per_second'], before.get('files_per_second')),
+                            ),
+                            '%.1f%s' % (
+                                result['mb_per_second'],
+                                format_change(result['mb_per_second'], before.get('mb_per_second')),
+                            ),
+                            '%d%s' % (
+                                result['round_trips'],
+                                format_change(result['round_trips'], before.get('round_trips')),
+                            ),
+                            '%.1f' % (result['max_rss_kb'] / 1024.0),
+                        )
+                    )
+                    for warning in upload['warnings']:
+                        print('      warning: %s' % warning)
+            finally:
+                if protocol == 'sftp':
+                    server.close()
+                else:
+                    server.shutdown()
+                    server.server_close()
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
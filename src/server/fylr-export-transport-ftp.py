@@ -3,55 +3,82 @@
 
 import sys
 import json
-from shared import util
+from typing import Optional
+from shared import util, manifest, archive, fanout
 import fylr_lib_plugin_python3.util as fylr_util
 
 
 def rclone_sync_to_ftp(
     opts: util.PluginInfoJson,
-) -> tuple[int, list[str], list[str]]:
+) -> tuple[int, list[str], list[str], Optional[dict]]:
 
     http_url = opts.format_export_http_url()
 
     ftp_url = f':{opts.rclone_ftp_method}:{opts.target_dir}/{opts.export_name}'
+    if opts.transport_compression:
+        ftp_url = util.rclone_compress_remote(ftp_url)
 
     parameter_map = opts.ftp_params.copy()
+    parameter_map.update(opts.rclone_tuning)
     parameter_map['http-url'] = http_url
 
-    parameters = [
-        'sync',
-        ':http:',
+    return manifest.rclone_sync_with_manifest(
+        opts,
         ftp_url,
-    ] + util.add_rclone_parameters(
-        parameter_map,
-        opts.additional_parameters,
-    )
-
-    return util.run_rclone_command(
-        parameters, util.rclone_log_level(opts.rclone_log_debug)
+        util.add_rclone_parameters(
+            parameter_map,
+            opts.additional_parameters,
+        )
+        + opts.rclone_filters,
     )
 
 
 def rclone_copyurl_to_ftp(
     opts: util.PluginInfoJson,
-) -> tuple[int, list[str], list[str]]:
+) -> tuple[int, list[str], list[str], Optional[dict]]:
 
     http_url = opts.format_export_http_url()
 
     ftp_url = f':{opts.rclone_ftp_method}:{opts.target_dir}/{opts.export_name}.{opts.transport_packer}'
 
+    parameter_map = opts.ftp_params.copy()
+    parameter_map.update(opts.rclone_tuning)
+
     parameters = [
         'copyurl',
         http_url,
         ftp_url,
     ] + util.add_rclone_parameters(
-        opts.ftp_params,
+        parameter_map,
         opts.additional_parameters,
     )
 
     return util.run_rclone_command(
         parameters,
         util.rclone_log_level(opts.rclone_log_debug),
+        rc_url=opts.rclone_rc_url,
+    )
+
+
+def rclone_stream_archive_to_ftp(
+    opts: util.PluginInfoJson,
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+
+    extension = util.STREAM_PACKERS[opts.transport_packer]
+    ftp_url = f':{opts.rclone_ftp_method}:{opts.target_dir}/{opts.export_name}.{extension}'
+
+    parameter_map = opts.ftp_params.copy()
+    parameter_map.update(opts.rclone_tuning)
+    parameter_map['http-url'] = opts.format_export_http_url()
+
+    return archive.rclone_stream_archive(
+        opts,
+        ftp_url,
+        util.add_rclone_parameters(
+            parameter_map,
+            opts.additional_parameters,
+        )
+        + opts.rclone_filters,
     )
 
 
@@ -68,14 +95,42 @@ if __name__ == '__main__':
         parsed_opts = util.PluginInfoJson('ftp', info_json, stdin_json)
         export_response = parsed_opts.export
 
+        if len(parsed_opts.fanout_targets) > 0:
+            # fetch the export once and upload it to all targets in parallel
+            fetch_log, results = fanout.rclone_fanout(
+                parsed_opts, parsed_opts.fanout_targets
+            )
+            util.return_json_body(
+                util.format_fanout_response(export_response, fetch_log, results)
+            )
+
         # depending on the packer, decide which rclone method to use
         if not parsed_opts.transport_packer or parsed_opts.transport_packer == 'folder':
             # sync all exported files and folders from the export with the ftp target directory
-            exit_code, rclone_stdout, rclone_stderr = rclone_sync_to_ftp(parsed_opts)
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_sync_to_ftp(parsed_opts)
 
         elif parsed_opts.transport_packer in ['zip', 'tar.gz']:
             # copy the exported archive files from the export to the ftp target directory
-            exit_code, rclone_stdout, rclone_stderr = rclone_copyurl_to_ftp(parsed_opts)
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_copyurl_to_ftp(parsed_opts)
+
+        elif parsed_opts.transport_packer in util.STREAM_PACKERS:
+            # pack the exported files and folders on the fly and stream the archive to the ftp target directory
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_stream_archive_to_ftp(parsed_opts)
 
         else:
             raise Exception(f'unknown packer {parsed_opts.transport_packer}')
@@ -86,6 +141,7 @@ if __name__ == '__main__':
                 exit_code,
                 rclone_stdout,
                 rclone_stderr,
+                rclone_stats,
             )
         )
 
@@ -3,34 +3,35 @@
 
 import sys
 import json
-from shared import util
+from typing import Optional
+from shared import util, manifest, archive, fanout
 import fylr_lib_plugin_python3.util as fylr_util
 
 
 def rclone_sync_to_webdav(
     opts: util.PluginInfoJson,
-) -> tuple[int, list[str], list[str]]:
+) -> tuple[int, list[str], list[str], Optional[dict]]:
     parameter_map = opts.webdav_params.copy()
+    parameter_map.update(opts.rclone_tuning)
     parameter_map['http-url'] = opts.format_export_http_url()
 
-    parameters = [
-        'sync',
-        ':http:',
-        ':webdav:{0}/{1}/'.format(
-            '/{0}'.format(opts.target_dir) if len(opts.target_dir) > 0 else '',
-            opts.export_name,
-        ),
-    ] + util.add_rclone_parameters(parameter_map)
+    webdav_url = ':webdav:{0}/{1}/'.format(
+        '/{0}'.format(opts.target_dir) if len(opts.target_dir) > 0 else '',
+        opts.export_name,
+    )
+    if opts.transport_compression:
+        webdav_url = util.rclone_compress_remote(webdav_url)
 
-    return util.run_rclone_command(
-        parameters,
-        util.rclone_log_level(opts.rclone_log_debug),
+    return manifest.rclone_sync_with_manifest(
+        opts,
+        webdav_url,
+        util.add_rclone_parameters(parameter_map) + opts.rclone_filters,
     )
 
 
 def rclone_copyurl_to_webdav(
     opts: util.PluginInfoJson,
-) -> tuple[int, list[str], list[str]]:
+) -> tuple[int, list[str], list[str], Optional[dict]]:
     http_url = opts.format_export_http_url()
     webdav_url = ':webdav:/{0}/{1}.{2}'.format(
         '/{0}'.format(opts.target_dir) if len(opts.target_dir) > 0 else '',
@@ -38,15 +39,39 @@ def rclone_copyurl_to_webdav(
         opts.transport_packer,
     )
 
+    parameter_map = opts.webdav_params.copy()
+    parameter_map.update(opts.rclone_tuning)
+
     parameters = [
         'copyurl',
         http_url,
         webdav_url,
-    ] + util.add_rclone_parameters(opts.webdav_params)
+    ] + util.add_rclone_parameters(parameter_map)
 
     return util.run_rclone_command(
         parameters,
         util.rclone_log_level(opts.rclone_log_debug),
+        rc_url=opts.rclone_rc_url,
+    )
+
+
+def rclone_stream_archive_to_webdav(
+    opts: util.PluginInfoJson,
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+    parameter_map = opts.webdav_params.copy()
+    parameter_map.update(opts.rclone_tuning)
+    parameter_map['http-url'] = opts.format_export_http_url()
+
+    webdav_url = ':webdav:/{0}/{1}.{2}'.format(
+        '/{0}'.format(opts.target_dir) if len(opts.target_dir) > 0 else '',
+        opts.export_name,
+        util.STREAM_PACKERS[opts.transport_packer],
+    )
+
+    return archive.rclone_stream_archive(
+        opts,
+        webdav_url,
+        util.add_rclone_parameters(parameter_map) + opts.rclone_filters,
     )
 
 
@@ -62,19 +87,45 @@ if __name__ == '__main__':
         parsed_opts = util.PluginInfoJson('webdav', info_json, stdin_json)
         export_response = parsed_opts.export
 
+        if len(parsed_opts.fanout_targets) > 0:
+            # fetch the export once and upload it to all targets in parallel
+            fetch_log, results = fanout.rclone_fanout(
+                parsed_opts, parsed_opts.fanout_targets
+            )
+            util.return_json_body(
+                util.format_fanout_response(export_response, fetch_log, results)
+            )
+
         # depending on the packer, decide which rclone method to use
         if (
             parsed_opts.transport_packer is None
             or parsed_opts.transport_packer == 'folder'
         ):
             # sync all exported files and folders from the export with the webdav target directory
-            exit_code, rclone_stdout, rclone_stderr = rclone_sync_to_webdav(parsed_opts)
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_sync_to_webdav(parsed_opts)
 
         elif parsed_opts.transport_packer in ['zip', 'tar.gz']:
             # copy the exported archive files from the export to the webdav target directory
-            exit_code, rclone_stdout, rclone_stderr = rclone_copyurl_to_webdav(
-                parsed_opts
-            )
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_copyurl_to_webdav(parsed_opts)
+
+        elif parsed_opts.transport_packer in util.STREAM_PACKERS:
+            # pack the exported files and folders on the fly and stream the archive to the webdav target directory
+            (
+                exit_code,
+                rclone_stdout,
+                rclone_stderr,
+                rclone_stats,
+            ) = rclone_stream_archive_to_webdav(parsed_opts)
 
         else:
             raise Exception(f'unknown packer {parsed_opts.transport_packer}')
@@ -85,6 +136,7 @@ if __name__ == '__main__':
                 exit_code,
                 rclone_stdout,
                 rclone_stderr,
+                rclone_stats,
             )
         )
 
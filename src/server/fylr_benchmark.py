@@ -0,0 +1,375 @@
+#!/usr/bin/python
+# coding=utf8
+
+"""
+end-to-end benchmark for the fylr transport scripts fylr-export-transport-ftp.py and
+fylr-export-transport-webdav.py.
+
+the scripts are run as separate processes with export data on stdin and info.json as first
+argument, like fylr does. a stub rclone on PATH writes a configurable amount of log output and
+exits with a configurable exit code, so only the cost of the scripts themselves is measured:
+reading the input, parsing the options, obscuring the password, reading and cleaning the rclone
+output and writing the response.
+
+usage:
+    python3 fylr_benchmark.py [--scripts ftp,webdav] [--packers folder,zip]
+                              [--lines 1000000] [--errors 0] [--debug] [--exit-code 0]
+                              [--json results.json] [--baseline previous.json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import runpy
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    'ftp': 'fylr-export-transport-ftp.py',
+    'webdav': 'fylr-export-transport-webdav.py',
+}
+
+# function of the plugin modules -> phase name, nested phases are measured inclusive
+PHASES = [
+    ('util', 'read_json_from_stdin', 'read input'),
+    ('util', 'PluginInfoJson', 'parse options'),
+    ('util', 'rclone_obscure_password', 'obscure password'),
+    ('util', 'rclone_list_source_files', 'list source'),
+    ('util', 'run_rclone_command', 'rclone'),
+    ('util', 'format_export_response', 'format response'),
+    ('util', 'return_json_body', 'write response'),
+]
+
+# stub for rclone, configured by environment variables
+RCLONE_STUB = '''#!%(python)s
+import os
+import sys
+
+command = sys.argv[1] if len(sys.argv) > 1 else ''
+
+if command == 'obscure':
+    import base64
+    print(base64.urlsafe_b64encode(os.urandom(16) + sys.argv[2].encode()).decode().rstrip('='))
+    sys.exit(0)
+
+if command == 'lsjson':
+    files = int(os.environ.get('BENCH_RCLONE_FILES', '0'))
+    out = sys.stdout
+    out.write('[\\n')
+    for i in range(files):
+        out.write('{"Path":"dir%%d/file%%07d.jpg","Name":"file%%07d.jpg","Size":%%d,'
+                  '"MimeType":"image/jpeg","ModTime":"2024-01-01T12:00:00Z","IsDir":false}%%s\\n'
+                  %% (i // 1000, i, i, 1024 + i, ',' if i < files - 1 else ''))
+    out.write(']\\n')
+    sys.exit(0)
+
+if command == 'rcat':
+    while sys.stdin.buffer.read(1024 * 1024):
+        pass
+
+level = b'DEBUG' if '--log-level=DEBUG' in sys.argv else b'INFO'
+lines = int(os.environ.get('BENCH_RCLONE_LINES', '0'))
+errors = int(os.environ.get('BENCH_RCLONE_ERRORS', '0'))
+error_every = lines // errors if errors > 0 else 0
+
+if '--use-json-log' in sys.argv:
+    copied = (b'{"level":"%%s","msg":"Copied (new)","object":"dir%%d/file%%07d.jpg",'
+              b'"objectType":"*ftp.Object","source":"operations/copy.go:368",'
+              b'"time":"2024-01-01T12:00:00.000000+00:00"}\\n')
+    failed = (b'{"level":"error","msg":"Failed to copy: 550 Permission denied",'
+              b'"object":"dir%%d/file%%07d.jpg","objectType":"*ftp.Object",'
+              b'"source":"operations/copy.go:368","time":"2024-01-01T12:00:00.000000+00:00"}\\n')
+    stats = (b'{"level":"info","msg":"\\\\nTransferred: %%d / %%d, 100%%%%\\\\n",'
+             b'"source":"accounting/stats.go:498","stats":{"bytes":%%d,"checks":0,"deletes":0,'
+             b'"elapsedTime":1.5,"errors":%%d,"transfers":%%d},'
+             b'"time":"2024-01-01T12:00:01.500000+00:00"}\\n'
+             %% (lines, lines, lines * 1024, errors, lines - errors))
+    level = level.lower()
+else:
+    copied = b'2024/01/01 12:00:00 %%s : dir%%d/file%%07d.jpg: Copied (new)\\n'
+    failed = b'2024/01/01 12:00:00 ERROR : dir%%d/file%%07d.jpg: Failed to copy: 550 Permission denied\\n'
+    stats = b'2024/01/01 12:00:00 INFO  : \\nTransferred: %%d / %%d, 100%%%%\\n' %% (lines, lines)
+
+out = sys.stderr.buffer
+chunk = []
+for i in range(lines):
+    if error_every and i %% error_every == 0:
+        chunk.append(failed %% (i // 1000, i))
+    else:
+        chunk.append(copied %% (level, i // 1000, i))
+    if len(chunk) == 10000:
+        out.write(b''.join(chunk))
+        chunk = []
+out.write(b''.join(chunk))
+out.write(stats)
+out.flush()
+sys.exit(int(os.environ.get('BENCH_RCLONE_EXIT_CODE', '0')))
+'''
+
+
+def make_inputs(target, packer, debug):
+    """
+    export data for stdin and info.json for the transport to the (stub) server
+    """
+    stdin_json = {
+        'export': {
+            'export': {
+                '_id': 1,
+                'name': 'benchmark',
+            },
+            '_state': 'processing',
+        },
+    }
+
+    options = {
+        'directory': 'benchmark',
+        'packer': packer,
+    }
+    if target == 'ftp':
+        options.update({
+            'server': 'sftp://127.0.0.1:2222',
+            'login': 'bench',
+            'password': 'bench',
+        })
+    else:
+        options.update({
+            'server': 'http://127.0.0.1:8080/remote.php/webdav',
+            'webdav_user': 'bench',
+            'webdav_pass': 'bench',
+            # the vendor is not detected, the options phase makes no request
+            'vendor': 'other',
+        })
+
+    info_json = {
+        'api_callback': {
+            'url': 'http://127.0.0.1:1',
+        },
+        'info': {
+            'config': {
+                'plugin': {
+                    'easydb-export-transport-ftp-plugin': {
+                        'config': {
+                            'rclone': {
+                                'rclone_log_debug': debug,
+                                # no transfer manifest, every run is a full sync
+                                'rclone_manifest_max_age': 0,
+                            },
+                        },
+                    },
+                },
+            },
+        },
+        'transport': {
+            'uuid': 'benchmark',
+            'options': options,
+        },
+    }
+    return stdin_json, info_json
+
+
+#
+# script runner (runs in its own process)
+#
+
+
+def run_script(script, report_file, info_json):
+    """
+    run the script like fylr does, with timers around the phases
+    """
+    sys.path.insert(0, SERVER_DIR)
+    from shared import util
+
+    modules = {'util': util}
+    times = {}
+
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+        return wrapper
+
+    for module, attr, name in PHASES:
+        func = getattr(modules[module], attr)
+        if isinstance(func, type):
+            func.__init__ = timed(name, func.__init__)
+        else:
+            setattr(modules[module], attr, timed(name, func))
+
+    sys.argv = [script, info_json]
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout.flush()
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with open(report_file, 'w') as f:
+            json.dump(
+                {
+                    'phases': times,
+                    'cpu_seconds': self_usage.ru_utime + self_usage.ru_stime,
+                    'max_rss_kb': self_usage.ru_maxrss,
+                    'rclone_cpu_seconds': children_usage.ru_utime + children_usage.ru_stime,
+                    'rclone_max_rss_kb': children_usage.ru_maxrss,
+                },
+                f,
+            )
+
+
+#
+# driver
+#
+
+
+def format_change(value, baseline):
+    if not baseline:
+        return ''
+    return ' (%+.0f%%)' % ((value - baseline) * 100.0 / baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--scripts', default=','.join(SCRIPTS))
+    parser.add_argument('--packers', default='folder,zip')
+    parser.add_argument('--lines', type=int, default=1000000, help='log lines of the rclone stub')
+    parser.add_argument('--errors', type=int, default=0, help='error lines among the log lines')
+    parser.add_argument('--debug', action='store_true', help='set rclone_log_debug')
+    parser.add_argument('--exit-code', type=int, default=0, help='exit code of the rclone stub')
+    parser.add_argument('--files', type=int, default=10000, help='files listed by rclone lsjson')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with the results of a previous run')
+    parser.add_argument('--run', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_script(*args.run)
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(r['script'], r['packer']): r for r in json.load(f)}
+
+    workdir = tempfile.mkdtemp(prefix='fylr-benchmark-')
+    results = []
+    try:
+        bin_dir = os.path.join(workdir, 'bin')
+        os.makedirs(bin_dir)
+        stub = os.path.join(bin_dir, 'rclone')
+        with open(stub, 'w') as f:
+            f.write(RCLONE_STUB % {'python': sys.executable})
+        os.chmod(stub, os.stat(stub).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+        env = dict(os.environ)
+        env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = SERVER_DIR + os.pathsep + env.get('PYTHONPATH', '')
+        env['BENCH_RCLONE_LINES'] = str(args.lines)
+        env['BENCH_RCLONE_ERRORS'] = str(args.errors)
+        env['BENCH_RCLONE_EXIT_CODE'] = str(args.exit_code)
+        env['BENCH_RCLONE_FILES'] = str(args.files)
+
+        print(
+            'rclone stub: %d %s lines, %d errors, exit code %d'
+            % (args.lines, 'DEBUG' if args.debug else 'INFO', args.errors, args.exit_code)
+        )
+
+        for target in args.scripts.split(','):
+            for packer in args.packers.split(','):
+                stdin_json, info_json = make_inputs(target, packer, args.debug)
+                report_file = os.path.join(workdir, 'report.json')
+
+                start = time.monotonic()
+                proc = subprocess.run(
+                    [
+                        sys.executable, os.path.abspath(__file__),
+                        '--run', os.path.join(SERVER_DIR, SCRIPTS[target]),
+                        report_file, json.dumps(info_json),
+                    ],
+                    input=json.dumps(stdin_json).encode('utf-8'),
+                    stdout=subprocess.PIPE,
+                    env=env,
+                )
+                seconds = time.monotonic() - start
+
+                with open(report_file) as f:
+                    report = json.load(f)
+                try:
+                    response = json.loads(proc.stdout)
+                except ValueError:
+                    response = {}
+
+                result = {
+                    'script': target,
+                    'packer': packer,
+                    'lines': args.lines,
+                    'seconds': seconds,
+                    'state': response.get('_state', 'invalid response'),
+                    'response_bytes': len(proc.stdout),
+                    'response_log_lines': len(response.get('_transport_log', [])),
+                    'transport_stats': response.get('_transport_stats'),
+                }
+                result.update(report)
+                results.append(result)
+
+                before = baseline.get((target, packer), {})
+                print()
+                print(
+                    '%s %s: %.2fs wall%s, %.2fs cpu, peak RSS %.1f MB%s, response %s (%d bytes, %d log lines)'
+                    % (
+                        SCRIPTS[target],
+                        packer,
+                        seconds,
+                        format_change(seconds, before.get('seconds')),
+                        report['cpu_seconds'],
+                        report['max_rss_kb'] / 1024.0,
+                        format_change(report['max_rss_kb'], before.get('max_rss_kb')),
+                        result['state'],
+                        result['response_bytes'],
+                        result['response_log_lines'],
+                    )
+                )
+                if result['transport_stats']:
+                    print('    transport stats: %s' % json.dumps(result['transport_stats']))
+                for _, _, name in PHASES:
+                    if name in report['phases']:
+                        print(
+                            '    %-17s %8.3fs%s'
+                            % (
+                                name,
+                                report['phases'][name],
+                                format_change(
+                                    report['phases'][name],
+                                    before.get('phases', {}).get(name),
+                                ),
+                            )
+                        )
+                print(
+                    '    %-17s %8.3fs cpu, peak RSS %.1f MB'
+                    % (
+                        'rclone stub',
+                        report['rclone_cpu_seconds'],
+                        report['rclone_max_rss_kb'] / 1024.0,
+                    )
+                )
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# encoding: utf-8
+
+import re
+import tarfile
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from typing import Optional
+
+from shared import util
+
+# block size for reading the files from the export and writing the archive stream
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+MOD_TIME_REGEX = re.compile(
+    r'^(?P<time>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(\.\d+)?(?P<zone>Z|[+-]\d{2}:\d{2})?$'
+)
+
+
+def parse_mod_time(mod_time: str) -> int:
+    """
+    parse the modification time of rclone lsjson (RFC 3339 with nanoseconds), fractions are ignored
+    """
+    match = MOD_TIME_REGEX.match(mod_time or '')
+    if not match:
+        return 0
+    zone = match.group('zone') or 'Z'
+    if zone == 'Z':
+        zone = '+00:00'
+    return int(datetime.fromisoformat(match.group('time') + zone).timestamp())
+
+
+def write_tar_stream(
+    fileobj,
+    http_url: str,
+    source_files: dict,
+    root: str,
+    compress: bool,
+) -> None:
+    """
+    read the files of the export tree one by one over http and write them as a tar stream
+    into fileobj, nothing is staged on disk
+    """
+    with tarfile.open(
+        fileobj=fileobj,
+        mode='w|gz' if compress else 'w|',
+        bufsize=STREAM_BLOCK_SIZE,
+    ) as tar:
+        for path in sorted(source_files):
+            size, mod_time = source_files[path]
+
+            info = tarfile.TarInfo(f'{root}/{path}')
+            info.size = size
+            info.mtime = parse_mod_time(mod_time)
+
+            with urllib.request.urlopen(http_url + urllib.parse.quote(path)) as response:
+                tar.addfile(info, response)
+
+
+def rclone_stream_archive(
+    opts: util.PluginInfoJson,
+    target: str,
+    parameters: list[str],
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+    """
+    pack the http export tree into a tar (.gz) archive on the fly and upload it with rclone rcat,
+    the first bytes are sent before the last file is read. rcat is not available in the rc api,
+    rclone is always run
+    """
+    exit_code, source_files, stderr = util.rclone_list_source_files(
+        parameters, opts.rclone_rc_url
+    )
+    if exit_code != 0:
+        return exit_code, ['could not list the exported files'], stderr, None
+
+    http_url = opts.format_export_http_url()
+    compress = util.STREAM_PACKERS[opts.transport_packer] == 'tar.gz'
+
+    exit_code, stdout, stderr, stats = util.run_rclone_command(
+        ['rcat', target] + parameters,
+        util.rclone_log_level(opts.rclone_log_debug),
+        stdin_writer=lambda pipe: write_tar_stream(
+            pipe, http_url, source_files, opts.export_name, compress
+        ),
+    )
+
+    return (
+        exit_code,
+        [f'streaming archive of {len(source_files)} files to {target}'] + stdout,
+        stderr,
+        stats,
+    )
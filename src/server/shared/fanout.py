@@ -0,0 +1,211 @@
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from shared import util, archive
+
+# the source of a fan-out transport is fetched once into this directory, one subdirectory per transport
+FANOUT_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), 'easydb-export-transport-ftp-plugin', 'fanout'
+)
+
+
+def fetch_source(
+    opts: util.PluginInfoJson,
+    cache_dir: str,
+    extension: Optional[str],
+    http_parameters: list[str],
+) -> tuple[list[str], Optional[str]]:
+    """
+    fetch the export once into the cache directory: the file tree, the archive of the export or
+    the tar (.gz) archive packed from the file tree.
+    returns the log and the local path of the source, None if the source does not fit into the
+    cache or could not be fetched, then each target fetches the source itself
+    """
+    max_size = opts.rclone_fanout_cache_size
+    if max_size <= 0:
+        return ['fan-out cache is disabled, each target fetches the export'], None
+
+    log_level = util.rclone_log_level(opts.rclone_log_debug)
+    http_url = opts.format_export_http_url()
+    packer = opts.transport_packer or 'folder'
+
+    if packer in ['zip', 'tar.gz']:
+        # the size of the archive is not known before, the download is aborted at the limit
+        source = os.path.join(cache_dir, f'{opts.export_name}.{extension}')
+        exit_code, stdout, stderr, _ = util.run_rclone_command(
+            [
+                'copyurl',
+                http_url,
+                source,
+                f'--max-transfer={max_size}b',
+                '--cutoff-mode=hard',
+            ],
+            log_level,
+        )
+        if exit_code != 0:
+            return (
+                stdout
+                + stderr
+                + [
+                    f'could not fetch the archive into the fan-out cache of {max_size} bytes, '
+                    'each target fetches the export'
+                ]
+            ), None
+        return ['fetched the archive of the export into the fan-out cache'], source
+
+    exit_code, source_files, stderr = util.rclone_list_source_files(
+        http_parameters + opts.rclone_filters, opts.rclone_rc_url
+    )
+    if exit_code != 0:
+        return stderr + ['could not list the exported files, each target fetches the export'], None
+
+    size = sum(f[0] or 0 for f in source_files.values())
+    if size > max_size:
+        return [
+            f'the export has {size} bytes, more than the fan-out cache of {max_size} bytes, '
+            'each target fetches the export'
+        ], None
+
+    if packer in util.STREAM_PACKERS:
+        source = os.path.join(cache_dir, f'{opts.export_name}.{extension}')
+        try:
+            with open(source, 'wb') as f:
+                archive.write_tar_stream(
+                    f, http_url, source_files, opts.export_name, extension == 'tar.gz'
+                )
+        except Exception as e:
+            return [
+                f'could not pack the archive in the fan-out cache: {e}, each target fetches the export'
+            ], None
+        return [
+            f'packed archive of {len(source_files)} files in the fan-out cache'
+        ], source
+
+    source = os.path.join(cache_dir, opts.export_name)
+    exit_code, stdout, stderr, _ = util.run_rclone_command(
+        [
+            'copy',
+            ':http:',
+            source,
+        ]
+        + http_parameters
+        + opts.rclone_filters
+        + util.add_rclone_parameters(
+            {
+                p: opts.rclone_tuning[p]
+                for p in ['transfers', 'checkers']
+                if p in opts.rclone_tuning
+            }
+        ),
+        log_level,
+        rc_url=opts.rclone_rc_url,
+    )
+    if exit_code != 0:
+        return (
+            stdout
+            + stderr
+            + ['could not fetch the export into the fan-out cache, each target fetches the export']
+        ), None
+    return [
+        f'fetched {len(source_files)} files ({size} bytes) into the fan-out cache'
+    ], source
+
+
+def upload_to_target(
+    opts: util.PluginInfoJson,
+    target: dict,
+    source: Optional[str],
+    extension: Optional[str],
+    http_parameters: list[str],
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+    """
+    upload the export to one target, from the cache or (if source is None) from the export.
+    errors are returned as result of the target, the other targets are not affected
+    """
+    try:
+        return rclone_upload_to_target(opts, target, source, extension, http_parameters)
+    except Exception as e:
+        return 1, [], [f'ERROR : {e}'], None
+
+
+def rclone_upload_to_target(
+    opts: util.PluginInfoJson,
+    target: dict,
+    source: Optional[str],
+    extension: Optional[str],
+    http_parameters: list[str],
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+    log_level = util.rclone_log_level(opts.rclone_log_debug)
+    parameters = util.add_rclone_parameters(target['parameters'], target['flags'])
+    packer = opts.transport_packer or 'folder'
+
+    if packer == 'folder':
+        # the filters also keep the excluded files on the target
+        parameters += opts.rclone_filters
+        remote = f'{target["remote"]}/{opts.export_name}'
+        if opts.transport_compression:
+            remote = util.rclone_compress_remote(remote)
+        if source:
+            command = ['sync', source, remote] + parameters
+        else:
+            command = ['sync', ':http:', remote] + parameters + http_parameters
+        return util.run_rclone_command(command, log_level, rc_url=opts.rclone_rc_url)
+
+    remote = f'{target["remote"]}/{opts.export_name}.{extension}'
+    if source:
+        command = ['copyto', source, remote] + parameters
+    elif packer in util.STREAM_PACKERS:
+        return archive.rclone_stream_archive(
+            opts, remote, parameters + http_parameters + opts.rclone_filters
+        )
+    else:
+        command = ['copyurl', opts.format_export_http_url(), remote] + parameters
+    return util.run_rclone_command(command, log_level, rc_url=opts.rclone_rc_url)
+
+
+def rclone_fanout(
+    opts: util.PluginInfoJson,
+    targets: list[dict],
+) -> tuple[list[str], list[tuple[dict, tuple[int, list[str], list[str], Optional[dict]]]]]:
+    """
+    transport the export to several targets: the export is fetched once into a local cache
+    (bounded by the plugin config rclone_fanout_cache_size) and uploaded from there to all targets
+    in parallel. returns the log of fetching the source and the result of each target
+    """
+    packer = opts.transport_packer or 'folder'
+    if packer in util.STREAM_PACKERS:
+        extension = util.STREAM_PACKERS[packer]
+    elif packer in ['zip', 'tar.gz']:
+        extension = packer
+    elif packer == 'folder':
+        extension = None
+    else:
+        raise Exception(f'unknown packer {packer}')
+
+    http_parameters = util.add_rclone_parameters(
+        {'http-url': opts.format_export_http_url()}
+    )
+
+    util.create_missing_dirs(FANOUT_CACHE_DIR)
+    cache_dir = tempfile.mkdtemp(dir=FANOUT_CACHE_DIR)
+    try:
+        fetch_log, source = fetch_source(opts, cache_dir, extension, http_parameters)
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            results = list(
+                executor.map(
+                    lambda target: upload_to_target(
+                        opts, target, source, extension, http_parameters
+                    ),
+                    targets,
+                )
+            )
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return fetch_log, list(zip(targets, results))
@@ -0,0 +1,172 @@
+# encoding: utf-8
+
+import os
+import json
+import re
+import time
+import tempfile
+from typing import Optional
+
+from shared import util
+
+# parameters which identify the remote side, together with the target path
+TARGET_PARAMETER_REGEX = re.compile(r'^--(ftp|sftp|webdav)-(host|port|user|url)=')
+
+# parameters which select the transported files, the manifest only covers these files
+FILTER_PARAMETER_REGEX = re.compile(r'^--(filter|min-size|max-size)=')
+
+# local state of the plugin, survives between transports of the same export
+MANIFEST_DIR = os.path.join(
+    tempfile.gettempdir(), 'easydb-export-transport-ftp-plugin', 'manifest'
+)
+
+
+class TransferManifest:
+    """
+    local record of the files which were already transferred to a target,
+    keyed by export id and transport uuid:
+    - target: the rclone target, the manifest is invalid if the target changes
+    - synced: timestamp of the last full sync, which also listed the remote side
+    - files: map of the file paths to [size, modification time]
+    """
+
+    def __init__(self, export_id: int, transport_uuid: str, target: str) -> None:
+        self.target = target
+        self.synced = 0
+        self.files = {}
+        self.__path = os.path.join(MANIFEST_DIR, f'{export_id}-{transport_uuid}.json')
+
+    def load(self) -> bool:
+        """
+        load the manifest, return False if it is missing, unreadable or for another target
+        """
+        try:
+            with open(self.__path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get('target') != self.target:
+            return False
+
+        self.synced = data.get('synced', 0)
+        self.files = data.get('files', {})
+        return True
+
+    def save(self) -> None:
+        util.create_missing_dirs(MANIFEST_DIR)
+        tmp_path = self.__path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(
+                {
+                    'target': self.target,
+                    'synced': self.synced,
+                    'files': self.files,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.__path)
+
+    def is_stale(self, max_age_hours: int) -> bool:
+        return time.time() - self.synced > max_age_hours * 3600
+
+    def changed_files(self, source_files: dict) -> list[str]:
+        return [p for p in source_files if self.files.get(p) != source_files[p]]
+
+    def removed_files(self, source_files: dict) -> list[str]:
+        return [p for p in self.files if p not in source_files]
+
+
+def rclone_sync_with_manifest(
+    opts: util.PluginInfoJson,
+    target: str,
+    parameters: list[str],
+) -> tuple[int, list[str], list[str], Optional[dict]]:
+    """
+    sync the http export tree to the target.
+
+    the remote side is only listed (full rclone sync) if the manifest is missing, stale or
+    files were removed from the export. else only new or changed files are copied, without
+    traversing or checking the remote side.
+    """
+    log_level = util.rclone_log_level(opts.rclone_log_debug)
+
+    def full_sync():
+        return util.run_rclone_command(
+            ['sync', ':http:', target] + parameters,
+            log_level,
+            rc_url=opts.rclone_rc_url,
+        )
+
+    if opts.rclone_manifest_max_age <= 0:
+        return full_sync()
+
+    manifest = TransferManifest(
+        opts.export_id,
+        opts.transport_uuid,
+        ' '.join(
+            [target]
+            + [
+                p
+                for p in parameters
+                if TARGET_PARAMETER_REGEX.match(p) or FILTER_PARAMETER_REGEX.match(p)
+            ]
+        ),
+    )
+    have_manifest = manifest.load()
+
+    exit_code, source_files, stderr = util.rclone_list_source_files(
+        parameters, opts.rclone_rc_url
+    )
+    if exit_code != 0:
+        # the sync will report the problem with the source
+        return full_sync()
+
+    reason = None
+    if not have_manifest:
+        reason = 'no transfer manifest'
+    elif manifest.is_stale(opts.rclone_manifest_max_age):
+        reason = f'transfer manifest is older than {opts.rclone_manifest_max_age} hours'
+    elif len(manifest.removed_files(source_files)) > 0:
+        reason = 'files were removed from the export'
+
+    if reason:
+        synced = time.time()
+        exit_code, stdout, stderr, stats = full_sync()
+        if exit_code == 0:
+            manifest.synced = synced
+            manifest.files = source_files
+            manifest.save()
+        return exit_code, [f'{reason}: full sync'] + stdout, stderr, stats
+
+    changed = manifest.changed_files(source_files)
+    info = [
+        f'transfer manifest: {len(changed)} of {len(source_files)} files are new or changed'
+    ]
+    if len(changed) == 0:
+        # nothing was transferred
+        return 0, info, [], util.rclone_transport_stats({})
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt') as files_from:
+        files_from.write('\n'.join(changed) + '\n')
+        files_from.flush()
+
+        exit_code, stdout, stderr, stats = util.run_rclone_command(
+            [
+                'copy',
+                ':http:',
+                target,
+                f'--files-from-raw={files_from.name}',
+                '--no-traverse',
+                '--no-check-dest',
+            ]
+            + parameters,
+            log_level,
+            rc_url=opts.rclone_rc_url,
+        )
+
+    if exit_code == 0:
+        manifest.files = source_files
+        manifest.save()
+
+    return exit_code, info + stdout, stderr, stats
@@ -0,0 +1,280 @@
+# encoding: utf-8
+
+import base64
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Optional
+
+# the job status is polled with an increasing interval, up to the maximum (in seconds)
+RC_POLL_INTERVAL = 0.1
+RC_POLL_MAX_INTERVAL = 2.0
+
+# timeout of a single request to the rc api (in seconds), not of the job
+RC_REQUEST_TIMEOUT = 30
+
+# backends whose flags (--<backend>-<option>) are part of the connection string of the remote
+RC_BACKENDS = ['ftp', 'sftp', 'webdav', 'http']
+
+# global flags -> key in _config
+RC_CONFIG_FLAGS = {
+    'transfers': ('Transfers', int),
+    'checkers': ('Checkers', int),
+    'buffer-size': ('BufferSize', str),
+    'multi-thread-streams': ('MultiThreadStreams', int),
+    'no-traverse': ('NoTraverse', bool),
+    'no-check-dest': ('NoCheckDest', bool),
+}
+
+# filter flags -> key in _filter, list values are collected
+RC_FILTER_FLAGS = {
+    'files-from-raw': ('FilesFromRaw', list),
+    'filter': ('FilterRule', list),
+    'min-size': ('MinSize', str),
+    'max-size': ('MaxSize', str),
+}
+
+# flags which have no effect in the rc api:
+# - the log of rcd is not returned, the stats of the job are read with core/stats
+# - the whole command is not retried, rcd only retries low level errors
+RC_IGNORED_FLAGS = ['log-level', 'use-json-log', 'retries']
+
+
+class RcloneRcUnavailable(Exception):
+    """
+    the rc api can not be reached or does not support the command, run rclone instead
+    """
+
+
+def quote_connection_string_value(value: str) -> str:
+    if not any(c in value for c in ',:="\''):
+        return value
+    return '"' + value.replace('"', '""') + '"'
+
+
+def translate_parameters(parameters: list[str]) -> Optional[tuple[list[str], dict]]:
+    """
+    translate the command line of rclone into the arguments of the rc api:
+    - positional arguments, the remotes are connection strings with the backend flags, e.g.
+        ':ftp:dir' + --ftp-host=h --ftp-tls -> ':ftp,host=h,tls=true:dir'
+    - _config and _filter for the global flags
+    returns None if a flag can not be translated
+    """
+    positional = []
+    backend_options = {}
+    config = {}
+    filter_options = {}
+    flags = []
+
+    for p in parameters:
+        if not p.startswith('--'):
+            positional.append(p)
+            continue
+
+        name, has_value, value = p[2:].partition('=')
+
+        backend = name.split('-', 1)[0]
+        if backend in RC_BACKENDS and '-' in name:
+            option = name.split('-', 1)[1].replace('-', '_')
+            backend_options.setdefault(backend, []).append(
+                (option, value if has_value else 'true')
+            )
+        elif name in RC_CONFIG_FLAGS:
+            key, value_type = RC_CONFIG_FLAGS[name]
+            if value_type == bool:
+                config[key] = not has_value or value.lower() == 'true'
+            else:
+                try:
+                    config[key] = value_type(value)
+                except ValueError:
+                    return None
+        elif name in RC_FILTER_FLAGS:
+            key, value_type = RC_FILTER_FLAGS[name]
+            if value_type == list:
+                filter_options.setdefault(key, []).append(value)
+            else:
+                filter_options[key] = value_type(value)
+        elif name in RC_IGNORED_FLAGS:
+            continue
+        else:
+            flags.append(name)
+
+    # lsjson flags are options of operations/list
+    if len(positional) > 0 and positional[0] == 'lsjson':
+        flags = [f for f in flags if f not in ['recursive', 'files-only']]
+    if len(flags) > 0:
+        return None
+
+    # the backend flags of a wrapped remote can not be moved into its connection string
+    if any(p.startswith(':compress') for p in positional):
+        return None
+
+    remotes = []
+    for p in positional:
+        if p.startswith(':') and ':' in p[1:]:
+            backend, path = p[1:].split(':', 1)
+            for option, value in backend_options.get(backend, []):
+                backend += f',{option}={quote_connection_string_value(value)}'
+            p = f':{backend}:{path}'
+        remotes.append(p)
+
+    arguments = {}
+    if len(config) > 0:
+        arguments['_config'] = config
+    if len(filter_options) > 0:
+        arguments['_filter'] = filter_options
+
+    return remotes, arguments
+
+
+def split_remote(remote: str) -> tuple[str, str]:
+    """
+    split a remote path into the fs and the path of the file in it:
+    ':ftp,host=h:dir/file.zip' -> (':ftp,host=h:dir', 'file.zip')
+    """
+    if ':' not in remote:
+        # local path, e.g. the cache of a fan-out transport
+        directory, _, name = remote.rpartition('/')
+        return directory or '/', name
+    # the connection string may contain quoted ':', the path starts after the last one
+    fs, path = remote.rsplit(':', 1)
+    directory, _, name = path.rpartition('/')
+    return f'{fs}:{directory}', name
+
+
+class RcloneRc:
+    """
+    client for the remote control api of a running rclone rcd (https://rclone.org/rc/),
+    the connections of the remotes are cached by rcd across the transports
+    """
+
+    def __init__(self, url: str) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        self.__authorization = None
+        if parsed.username:
+            credentials = '{0}:{1}'.format(
+                urllib.parse.unquote(parsed.username),
+                urllib.parse.unquote(parsed.password or ''),
+            )
+            self.__authorization = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')
+            ).decode('ascii')
+            parsed = parsed._replace(netloc=parsed.netloc.rsplit('@', 1)[1])
+        self.url = urllib.parse.urlunsplit(parsed).rstrip('/')
+
+    def call(self, method: str, arguments: dict) -> dict:
+        """
+        call a method of the rc api, raise RcloneRcUnavailable if rcd can not be reached or does
+        not know the method, and Exception with the error of rcd if the call failed
+        """
+        request = urllib.request.Request(
+            f'{self.url}/{method}',
+            data=json.dumps(arguments).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        if self.__authorization:
+            request.add_header('Authorization', self.__authorization)
+
+        try:
+            with urllib.request.urlopen(request, timeout=RC_REQUEST_TIMEOUT) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise RcloneRcUnavailable(f'rclone rc: unknown method {method}')
+            try:
+                error = json.load(e).get('error', e.reason)
+            except ValueError:
+                error = e.reason
+            raise Exception(f'rclone rc {method}: {error}')
+        except (urllib.error.URLError, ConnectionError) as e:
+            raise RcloneRcUnavailable(f'rclone rc is not reachable at {self.url}: {e}')
+
+    def run_job(self, method: str, arguments: dict) -> tuple[dict, dict]:
+        """
+        start the method as async job and wait until it is finished,
+        return the job status and the stats of the job
+        """
+        jobid = self.call(method, dict(arguments, _async=True))['jobid']
+
+        interval = RC_POLL_INTERVAL
+        while True:
+            try:
+                status = self.call('job/status', {'jobid': jobid})
+            except RcloneRcUnavailable as e:
+                # the job was started, it must not be run again by rclone
+                raise Exception(f'rclone rc job {jobid}: {e}')
+            if status.get('finished'):
+                break
+            time.sleep(interval)
+            interval = min(interval * 2, RC_POLL_MAX_INTERVAL)
+
+        # async jobs collect their stats in the group job/<jobid>
+        group = f'job/{jobid}'
+        stats = self.call('core/stats', {'group': group})
+        try:
+            self.call('core/stats-delete', {'group': group})
+        except Exception:
+            pass
+
+        return status, stats
+
+    def run_command(self, parameters: list[str]) -> tuple[dict, dict, Optional[dict]]:
+        """
+        run a command line of rclone as rc job: sync, copy, copyurl, copyto or lsjson.
+        returns the job status, the stats and the output of the job.
+        raises RcloneRcUnavailable if the command can not be run with the rc api
+        """
+        translated = translate_parameters(parameters)
+        if translated is None:
+            raise RcloneRcUnavailable('rclone rc: parameters are not supported')
+        remotes, arguments = translated
+        if len(remotes) < 2:
+            raise RcloneRcUnavailable('rclone rc: command is not supported')
+
+        command = remotes[0]
+        if command in ['sync', 'copy'] and len(remotes) == 3:
+            status, stats = self.run_job(
+                f'sync/{command}',
+                dict(arguments, srcFs=remotes[1], dstFs=remotes[2]),
+            )
+            return status, stats, None
+
+        if command == 'copyurl' and len(remotes) == 3:
+            fs, remote = split_remote(remotes[2])
+            status, stats = self.run_job(
+                'operations/copyurl',
+                dict(arguments, fs=fs, remote=remote, url=remotes[1], autoFilename=False),
+            )
+            return status, stats, None
+
+        if command == 'copyto' and len(remotes) == 3:
+            src_fs, src_remote = split_remote(remotes[1])
+            dst_fs, dst_remote = split_remote(remotes[2])
+            status, stats = self.run_job(
+                'operations/copyfile',
+                dict(
+                    arguments,
+                    srcFs=src_fs,
+                    srcRemote=src_remote,
+                    dstFs=dst_fs,
+                    dstRemote=dst_remote,
+                ),
+            )
+            return status, stats, None
+
+        if command == 'lsjson' and len(remotes) == 2:
+            status, stats = self.run_job(
+                'operations/list',
+                dict(
+                    arguments,
+                    fs=remotes[1],
+                    remote='',
+                    opt={'recurse': True, 'filesOnly': True},
+                ),
+            )
+            return status, stats, status.get('output')
+
+        raise RcloneRcUnavailable(f'rclone rc: command {command} is not supported')